@@ -0,0 +1,135 @@
+# Replays bursts of TradingView-style alerts against the webhook app running
+# on the mock exchange, under the Flask dev server and/or gunicorn.
+#
+#   python bench/load_test.py --server both --bursts 5 --burst-size 50 --latency-ms 30
+#   python bench/load_test.py --server gunicorn --workers 4 --threads 8 --job-mode
+#
+# Reports webhook p50/p99 latency, webhooks/s and orders/s accepted by the mock.
+import argparse
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from mock_binance import DEFAULT_PRICES, add_mock_arguments, mock_options, start_mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_app(server, port, env, args):
+    if server == "gunicorn":
+        cmd = [shutil.which("gunicorn") or "gunicorn", "-b", f"127.0.0.1:{port}",
+               "-w", str(args.workers), "-k", "gthread", "--threads", str(args.threads), "main:app"]
+    else:
+        cmd = [sys.executable, "main.py"]
+    log = open(os.path.join(ROOT, f"bench_{server}.log"), "w") if args.keep_logs else subprocess.DEVNULL
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    deadline = time.time() + 20
+    while time.time() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/", timeout=1)
+            return proc
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"{server} did not start on port {port}")
+
+def make_bursts(args):
+    assets = list(DEFAULT_PRICES)[:args.symbols]
+    bursts = []
+    n = 0
+    for _ in range(args.bursts):
+        burst = []
+        for _ in range(args.burst_size):
+            n += 1
+            action = "SELL" if random.random() < args.sell_ratio else "BUY"
+            burst.append({"symbol": f"{random.choice(assets)}USDC", "action": action,
+                          "size": args.size, "alert_id": f"load-{os.getpid()}-{n}"})
+        bursts.append(burst)
+    return bursts
+
+def fire(http, url, alert):
+    start = time.perf_counter()
+    try:
+        status = http.post(url, json=alert, timeout=60).status_code
+    except requests.RequestException:
+        status = None
+    return (time.perf_counter() - start) * 1000, status
+
+def percentile(samples, p):
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+def run(server, args):
+    _, exchange, mock_url = start_mock(**mock_options(args))
+    port = free_port()
+    env = dict(os.environ, PORT=str(port), BINANCE_BASE_URL=mock_url,
+               BINANCE_API_KEY="bench", BINANCE_SECRET_KEY="bench",
+               JOB_MODE="1" if args.job_mode else "0",
+               JOURNAL_PATH=os.path.join(tempfile.mkdtemp(), "journal.db"))
+    proc = start_app(server, port, env, args)
+
+    url = f"http://127.0.0.1:{port}/webhook"
+    samples, statuses = [], {}
+    http = requests.Session()
+    http.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency))
+    orders_before = exchange.stats["orders"]
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for burst in make_bursts(args):
+                for ms, status in pool.map(lambda a: fire(http, url, a), burst):
+                    samples.append(ms)
+                    statuses[status] = statuses.get(status, 0) + 1
+                time.sleep(args.pause)
+        if args.job_mode:
+            time.sleep(args.drain)
+        elapsed = time.perf_counter() - started - args.pause * args.bursts - (args.drain if args.job_mode else 0)
+    finally:
+        proc.terminate()
+        proc.wait()
+    orders = exchange.stats["orders"] - orders_before
+
+    samples.sort()
+    print(f"{server:<9} webhooks={len(samples)} p50={percentile(samples, 0.5):8.2f} ms "
+          f"p99={percentile(samples, 0.99):8.2f} ms  webhooks/s={len(samples) / elapsed:7.1f} "
+          f"orders/s={orders / elapsed:7.1f}  status={statuses}  mock={exchange.stats}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--server", choices=["dev", "gunicorn", "both"], default="both")
+    parser.add_argument("--bursts", type=int, default=5)
+    parser.add_argument("--burst-size", type=int, default=50)
+    parser.add_argument("--pause", type=float, default=0.5, help="seconds between bursts")
+    parser.add_argument("--concurrency", type=int, default=20, help="alerts in flight at once")
+    parser.add_argument("--symbols", type=int, default=10, help="distinct USDC pairs (max 30)")
+    parser.add_argument("--sell-ratio", type=float, default=0.2)
+    parser.add_argument("--size", type=float, default=0.1, help="percent of USDC per BUY")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument("--threads", type=int, default=8, help="gunicorn threads per worker")
+    parser.add_argument("--job-mode", action="store_true", help="run the app with JOB_MODE=1")
+    parser.add_argument("--drain", type=float, default=3.0, help="job mode: seconds to let queued orders finish")
+    parser.add_argument("--keep-logs", action="store_true", help="write app output to bench_<server>.log")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    servers = ["dev", "gunicorn"] if args.server == "both" else [args.server]
+    for server in servers:
+        if server == "gunicorn" and not shutil.which("gunicorn"):
+            print("⚠️ gunicorn not installed — skipping")
+            continue
+        run(server, args)
+
+if __name__ == "__main__":
+    main()
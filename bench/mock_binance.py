@@ -0,0 +1,346 @@
+# Local stand-in for the Binance spot REST endpoints main.py uses.
+#
+#   python bench/mock_binance.py --port 9000 --latency-ms 30 --error-rate 0.01
+#
+# Serves /api/v3/exchangeInfo, /api/v3/account, /api/v3/order (MARKET fills,
+# LIMIT GTC resting orders), /api/v3/openOrders and /api/v3/userDataStream.
+# Balances are kept in memory. Responses carry X-MBX-USED-WEIGHT-1M and
+# X-MBX-ORDER-COUNT-10S, counted per fixed window as Binance does; going over
+# --weight-limit or --order-limit returns 429 with Retry-After, and
+# --ban-after 429s inside a minute turn into 418s.
+import argparse
+import hashlib
+import hmac
+import json
+import random
+import threading
+import time
+from collections import deque
+from decimal import Decimal, ROUND_DOWN
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+DEFAULT_PRICES = {
+    "BTC": "60000", "ETH": "3000", "BNB": "600", "SOL": "150", "XRP": "0.6",
+    "ADA": "0.45", "DOGE": "0.15", "AVAX": "35", "LINK": "15", "DOT": "7",
+    "LTC": "80", "TRX": "0.12", "ATOM": "8", "NEAR": "5", "APT": "9",
+    "ARB": "1.1", "OP": "2.4", "FIL": "5.5", "INJ": "25", "SUI": "1.2",
+    "SEI": "0.5", "TIA": "8", "PEPE": "0.00001", "SHIB": "0.00002", "UNI": "9",
+    "AAVE": "95", "ETC": "25", "XLM": "0.11", "HBAR": "0.08", "ICP": "11",
+}
+
+ENDPOINT_WEIGHT = {
+    "/api/v3/exchangeInfo": 20,
+    "/api/v3/account": 20,
+    "/api/v3/order": 1,
+    "/api/v3/openOrders": 6,
+    "/api/v3/userDataStream": 2,
+}
+
+def num(value):
+    return format(value, "f")
+
+def step_for(price):
+    # Coarser lots for expensive coins, like the real filters
+    price = Decimal(price)
+    if price >= 1000:
+        return Decimal("0.00001")
+    if price >= 10:
+        return Decimal("0.001")
+    if price >= 0.1:
+        return Decimal("0.1")
+    return Decimal("1")
+
+def tick_for(price):
+    price = Decimal(price)
+    if price >= 1000:
+        return Decimal("0.01")
+    if price >= 1:
+        return Decimal("0.001")
+    return Decimal("0.0000001") if price < 0.001 else Decimal("0.00001")
+
+class MockExchange:
+    def __init__(self, quote="USDC", quote_balance="1000000", prices=None, secret=None,
+                 latency_ms=0.0, jitter_ms=0.0, connect_ms=0.0, error_rate=0.0,
+                 weight_limit=6000, order_limit=100, ban_after=0, retry_after=5):
+        self.quote = quote
+        self.prices = {f"{a}{quote}": Decimal(p) for a, p in (prices or DEFAULT_PRICES).items()}
+        self.secret = secret
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.connect_delay = connect_ms / 1000
+        self.error_rate = error_rate
+        self.weight_limit = weight_limit
+        self.order_limit = order_limit
+        self.ban_after = ban_after
+        self.retry_after = retry_after
+
+        self.lock = threading.Lock()
+        self.balances = {quote: [Decimal(quote_balance), Decimal(0)]}
+        for symbol in self.prices:
+            self.balances[symbol[:-len(quote)]] = [Decimal(0), Decimal(0)]
+        self.open_orders = {}
+        self.next_order_id = 1
+        self.weight_window = self.weight_used = 0   # per clock minute
+        self.order_window = self.order_used = 0     # per 10-second window
+        self.rejections = deque()   # 429 timestamps, for the 418 ban
+        self.banned_until = 0.0
+        self.stats = {"requests": 0, "orders": 0, "errors": 0, "429": 0, "418": 0}
+
+    # --- rate limits ---
+    def add_weight(self, now, weight):
+        if int(now // 60) != self.weight_window:
+            self.weight_window, self.weight_used = int(now // 60), 0
+        self.weight_used += weight
+        return self.weight_used
+
+    def add_order(self, now):
+        if int(now // 10) != self.order_window:
+            self.order_window, self.order_used = int(now // 10), 0
+        self.order_used += 1
+        return self.order_used
+
+    # Returns (status, body, headers) for a rejected call, else (None, None, headers)
+    def admit(self, path, is_order):
+        now = time.time()
+        with self.lock:
+            self.stats["requests"] += 1
+            if now < self.banned_until:
+                self.stats["418"] += 1
+                return 418, {"code": -1003, "msg": "Way too many requests; IP banned."}, \
+                    {"Retry-After": str(int(self.banned_until - now) + 1)}
+
+            weight = self.add_weight(now, ENDPOINT_WEIGHT.get(path, 1))
+            orders = self.add_order(now) if is_order else 0
+            headers = {"X-MBX-USED-WEIGHT-1M": str(weight)}
+            if is_order:
+                headers["X-MBX-ORDER-COUNT-10S"] = str(orders)
+
+            if weight > self.weight_limit or (is_order and orders > self.order_limit):
+                self.stats["429"] += 1
+                self.rejections.append(now)
+                while self.rejections and now - self.rejections[0] > 60:
+                    self.rejections.popleft()
+                if self.ban_after and len(self.rejections) >= self.ban_after:
+                    self.banned_until = now + self.retry_after * 10
+                headers["Retry-After"] = str(self.retry_after)
+                return 429, {"code": -1003, "msg": "Too many requests."}, headers
+        return None, None, headers
+
+    # --- endpoints ---
+    def exchange_info(self, params):
+        symbols = [params["symbol"]] if "symbol" in params else list(self.prices)
+        out = []
+        for symbol in symbols:
+            if symbol not in self.prices:
+                return 400, {"code": -1121, "msg": "Invalid symbol."}
+            price = self.prices[symbol]
+            out.append({
+                "symbol": symbol, "status": "TRADING",
+                "baseAsset": symbol[:-len(self.quote)], "quoteAsset": self.quote,
+                "quoteAssetPrecision": 8,
+                "filters": [
+                    {"filterType": "PRICE_FILTER", "minPrice": num(tick_for(price)),
+                     "maxPrice": "1000000", "tickSize": num(tick_for(price))},
+                    {"filterType": "LOT_SIZE", "minQty": num(step_for(price)),
+                     "maxQty": "9000000", "stepSize": num(step_for(price))},
+                    {"filterType": "NOTIONAL", "minNotional": "5", "applyMinToMarket": True,
+                     "maxNotional": "9000000", "applyMaxToMarket": False},
+                ],
+            })
+        return 200, {"symbols": out}
+
+    def account(self, params):
+        with self.lock:
+            balances = [{"asset": a, "free": num(f), "locked": num(l)} for a, (f, l) in self.balances.items()]
+        return 200, {"balances": balances}
+
+    def open_orders_list(self, params):
+        with self.lock:
+            orders = [o for o in self.open_orders.values()
+                      if "symbol" not in params or o["symbol"] == params["symbol"]]
+        return 200, orders
+
+    def order(self, params):
+        symbol = params.get("symbol")
+        if symbol not in self.prices:
+            return 400, {"code": -1121, "msg": "Invalid symbol."}
+        base = symbol[:-len(self.quote)]
+        price = self.prices[symbol]
+        step = step_for(price)
+        side, order_type = params.get("side"), params.get("type")
+
+        with self.lock:
+            base_bal, quote_bal = self.balances[base], self.balances[self.quote]
+            order_id = self.next_order_id
+            self.next_order_id += 1
+            result = {"symbol": symbol, "orderId": order_id, "clientOrderId": params.get("newClientOrderId", f"mock{order_id}"),
+                      "transactTime": int(time.time() * 1000), "type": order_type, "side": side,
+                      "timeInForce": params.get("timeInForce", "GTC")}
+
+            if order_type == "MARKET":
+                if "quoteOrderQty" in params:
+                    qty = (Decimal(params["quoteOrderQty"]) / price / step).to_integral_value(ROUND_DOWN) * step
+                else:
+                    qty = Decimal(params["quantity"])
+                cost = qty * price
+                if qty <= 0:
+                    return 400, {"code": -1013, "msg": "Filter failure: LOT_SIZE"}
+                if side == "BUY" and cost > quote_bal[0] or side == "SELL" and qty > base_bal[0]:
+                    return 400, {"code": -2010, "msg": "Account has insufficient balance for requested action."}
+                commission = qty * Decimal("0.001") if side == "BUY" else cost * Decimal("0.001")
+                if side == "BUY":
+                    quote_bal[0] -= cost
+                    base_bal[0] += qty - commission
+                else:
+                    base_bal[0] -= qty
+                    quote_bal[0] += cost - commission
+                result.update({
+                    "price": "0", "origQty": num(qty), "executedQty": num(qty),
+                    "cummulativeQuoteQty": num(cost), "status": "FILLED",
+                    "fills": [{"price": num(price), "qty": num(qty), "commission": num(commission),
+                               "commissionAsset": base if side == "BUY" else self.quote, "tradeId": order_id}],
+                })
+            elif order_type == "LIMIT":
+                qty, limit_price = Decimal(params["quantity"]), Decimal(params["price"])
+                if side == "SELL":
+                    if qty > base_bal[0]:
+                        return 400, {"code": -2010, "msg": "Account has insufficient balance for requested action."}
+                    base_bal[0] -= qty
+                    base_bal[1] += qty
+                else:
+                    if qty * limit_price > quote_bal[0]:
+                        return 400, {"code": -2010, "msg": "Account has insufficient balance for requested action."}
+                    quote_bal[0] -= qty * limit_price
+                    quote_bal[1] += qty * limit_price
+                result.update({"price": num(limit_price), "origQty": num(qty), "executedQty": "0",
+                               "cummulativeQuoteQty": "0", "status": "NEW", "fills": []})
+                self.open_orders[order_id] = {k: v for k, v in result.items() if k != "fills"}
+            else:
+                return 400, {"code": -1116, "msg": "Invalid orderType."}
+
+            self.stats["orders"] += 1
+        return 200, result
+
+    def handle(self, method, path, params, query=""):
+        if path == "/api/v3/exchangeInfo":
+            return self.exchange_info(params)
+        if path == "/api/v3/userDataStream":
+            return 200, {"listenKey": "mock-listen-key"} if method == "POST" else {}
+        if self.secret is not None and not self.signature_ok(query):
+            return 400, {"code": -1022, "msg": "Signature for this request is not valid."}
+        if path == "/api/v3/account" and method == "GET":
+            return self.account(params)
+        if path == "/api/v3/openOrders" and method == "GET":
+            return self.open_orders_list(params)
+        if path == "/api/v3/order" and method == "POST":
+            return self.order(params)
+        return 404, {"code": -1, "msg": f"No mock for {method} {path}"}
+
+    def signature_ok(self, query):
+        payload, _, signature = query.rpartition("&signature=")
+        expected = hmac.new(self.secret.encode(), payload.encode(), hashlib.sha256).hexdigest()
+        return hmac.compare_digest(signature, expected)
+
+def make_handler(exchange):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def setup(self):
+            super().setup()
+            if exchange.connect_delay:
+                time.sleep(exchange.connect_delay)
+
+        def log_message(self, *args):
+            pass
+
+        def reply(self, status, body, headers):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def dispatch(self, method):
+            url = urlparse(self.path)
+            params = dict(parse_qsl(url.query, keep_blank_values=True))
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                params.update(parse_qsl(self.rfile.read(length).decode(), keep_blank_values=True))
+
+            if exchange.latency or exchange.jitter:
+                time.sleep(exchange.latency + random.uniform(0, exchange.jitter))
+
+            is_order = url.path == "/api/v3/order" and method == "POST"
+            status, body, headers = exchange.admit(url.path, is_order)
+            if status is None:
+                if exchange.error_rate and random.random() < exchange.error_rate:
+                    with exchange.lock:
+                        exchange.stats["errors"] += 1
+                    status, body = 503, {"code": -1001, "msg": "Internal error; unable to process your request. Please try again."}
+                else:
+                    status, body = exchange.handle(method, url.path, params, url.query)
+            self.reply(status, body, headers)
+
+        def do_GET(self):
+            self.dispatch("GET")
+
+        def do_POST(self):
+            self.dispatch("POST")
+
+        def do_PUT(self):
+            self.dispatch("PUT")
+
+        def do_DELETE(self):
+            self.dispatch("DELETE")
+
+    return Handler
+
+# Starts the mock on a daemon thread; returns (server, exchange, base_url)
+def start_mock(host="127.0.0.1", port=0, **options):
+    exchange = MockExchange(**options)
+    server = ThreadingHTTPServer((host, port), make_handler(exchange))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, exchange, f"http://{host}:{server.server_port}"
+
+def add_mock_arguments(parser):
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="added to every response")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="random extra latency, uniform 0..N")
+    parser.add_argument("--connect-ms", type=float, default=0.0, help="delay per new connection (handshake)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with 503")
+    parser.add_argument("--weight-limit", type=int, default=6000, help="request weight per minute before 429")
+    parser.add_argument("--order-limit", type=int, default=100, help="orders per 10 s before 429")
+    parser.add_argument("--ban-after", type=int, default=0, help="429s per minute before a 418 ban (0 = never)")
+    parser.add_argument("--retry-after", type=int, default=5, help="Retry-After seconds on 429")
+
+def mock_options(args):
+    return {
+        "latency_ms": args.latency_ms, "jitter_ms": args.jitter_ms, "connect_ms": args.connect_ms,
+        "error_rate": args.error_rate, "weight_limit": args.weight_limit, "order_limit": args.order_limit,
+        "ban_after": args.ban_after, "retry_after": args.retry_after,
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--secret", default=None, help="verify HMAC signatures with this secret")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    server, exchange, url = start_mock(args.host, args.port, secret=args.secret, **mock_options(args))
+    print(f"🧪 Mock Binance listening on {url} (BINANCE_BASE_URL={url})")
+    try:
+        while True:
+            time.sleep(10)
+            print("📊", exchange.stats)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# Per-webhook latency: one new connection per call vs. the shared keep-alive pool.
+#
+#   python bench/webhook_latency.py --requests 200 --connect-ms 20
+#
+# --connect-ms makes the mock sleep once per new TCP connection, standing in
+# for the TCP + TLS handshake cost to api.binance.com.
+import argparse
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+import requests
+
+from mock_binance import start_mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run(client, n):
+    samples = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for i in range(n):
+            start = time.perf_counter()
+            client.post("/webhook", json={"symbol": "BTCUSDC", "action": "BUY", "size": 0.1, "alert_id": f"{id(samples)}-{i}"})
+            samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return samples
+
+def report(label, samples):
+    p50 = samples[len(samples) // 2]
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(f"{label:<10} p50={p50:7.2f} ms  p99={p99:7.2f} ms  mean={sum(samples) / len(samples):7.2f} ms")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--connect-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    # rate limits are not what this measures; lift them on both sides
+    server, exchange, url = start_mock(connect_ms=args.connect_ms, weight_limit=10**9, order_limit=10**9)
+
+    os.environ["BINANCE_BASE_URL"] = url
+    os.environ.setdefault("BINANCE_API_KEY", "bench")
+    os.environ.setdefault("BINANCE_SECRET_KEY", "bench")
+    # refetch the account on every call so both runs make the same four requests
+    os.environ.setdefault("BALANCE_TTL", "0")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("JOURNAL_PATH", os.path.join(tempfile.mkdtemp(), "journal.db"))
+    os.environ.setdefault("BINANCE_WEIGHT_LIMIT", str(10**9))
+    os.environ.setdefault("BINANCE_ORDER_LIMIT", str(10**9))
+    sys.path.insert(0, ROOT)
+    import main as bot
+
+    client = bot.app.test_client()
+    pooled = bot.session
+
+    # "before": module-level requests.request, a fresh connection on every call
+    bot.session = requests
+    report("per-call", run(client, args.requests))
+
+    bot.session = pooled
+    report("pooled", run(client, args.requests))
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -1,156 +1,1347 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response
 import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlencode
 import hmac
 import hashlib
+import json
+import re
+import logging
+import logging.handlers
+import queue
+import signal
+import sys
+import atexit
+import sqlite3
+import threading
 import time
 import os
+import uuid
+import tempfile
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from decimal import Decimal, ROUND_DOWN, ROUND_HALF_UP
 
-print("✅ Flask app loaded successfully")
+try:
+    import fcntl  # POSIX only; without it symbol locks are per process
+except ImportError:
+    fcntl = None
+
+try:
+    import websocket  # websocket-client, only needed for the user-data stream
+except ImportError:
+    websocket = None
 
 BINANCE_API_KEY = os.getenv("BINANCE_API_KEY")
 BINANCE_SECRET_KEY = os.getenv("BINANCE_SECRET_KEY")
-BASE_URL = "https://api.binance.com"
+BASE_URL = os.getenv("BINANCE_BASE_URL", "https://api.binance.com")
+
+# HTTP settings for the shared Binance session (pool size is set below the worker counts)
+CONNECT_TIMEOUT = float(os.getenv("BINANCE_CONNECT_TIMEOUT", 3.05))
+READ_TIMEOUT = float(os.getenv("BINANCE_READ_TIMEOUT", 10))
+
+# Balance cache: refetched from /api/v3/account once older than BALANCE_TTL seconds
+# (only while the user-data stream is not connected)
+BALANCE_TTL = float(os.getenv("BALANCE_TTL", 30))
+USER_STREAM = os.getenv("BINANCE_USER_STREAM", "0") == "1"
+STREAM_URL = os.getenv("BINANCE_STREAM_URL", "wss://stream.binance.com:9443/ws")
+
+# Job mode: /webhook answers 202 right away and orders run on a worker pool
+JOB_MODE = os.getenv("JOB_MODE", "0") == "1"
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 8))
+JOB_HISTORY = int(os.getenv("JOB_HISTORY", 1000))
+
+# /webhook/batch: max items per bundle and symbols executed at once
+BATCH_MAX = int(os.getenv("BATCH_MAX", 50))
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", 16))
+
+# Keep-alive connections kept for Binance: by default one per job or batch worker,
+# plus a few for balance/exchangeInfo refreshes and the listenKey keepalive
+POOL_SIZE = int(os.getenv("BINANCE_POOL_SIZE", max(BATCH_WORKERS, JOB_WORKERS) + 4))
+
+# Symbol filters from /api/v3/exchangeInfo, reloaded every EXCHANGE_INFO_TTL seconds
+EXCHANGE_INFO_TTL = float(os.getenv("EXCHANGE_INFO_TTL", 3600))
+TAKE_PROFIT = Decimal(os.getenv("TAKE_PROFIT", "1.015"))
+
+# Duplicate alerts (same alert id or identical payload) inside this window are dropped
+DEDUP_WINDOW = float(os.getenv("DEDUP_WINDOW", 60))
+DEDUP_MAX = int(os.getenv("DEDUP_MAX", 10000))
+LOCK_DIR = os.getenv("LOCK_DIR", os.path.join(tempfile.gettempdir(), "binance-webhook-locks"))
+
+# Order journal (SQLite, WAL). Empty JOURNAL_PATH disables it.
+JOURNAL_PATH = os.getenv("JOURNAL_PATH", "journal.db")
+# On startup, place take-profits for BUYs whose LIMIT SELL never made it out (the
+# process died in between). Off by default; positions pending for longer than
+# RESUME_MAX_AGE seconds are marked expired instead of resumed.
+RESUME_TAKE_PROFIT = os.getenv("RESUME_TAKE_PROFIT", "0") == "1"
+RESUME_MAX_AGE = float(os.getenv("RESUME_MAX_AGE", 600))
+
+# Request scheduler budgets (Binance spot defaults: 6000 weight/min, 100 orders/10s)
+WEIGHT_LIMIT = int(os.getenv("BINANCE_WEIGHT_LIMIT", 6000))
+ORDER_LIMIT = int(os.getenv("BINANCE_ORDER_LIMIT", 100))
+# Balance refreshes and other low-priority calls may only use this share of the weight budget
+LOW_PRIORITY_SHARE = float(os.getenv("LOW_PRIORITY_SHARE", 0.8))
+MAX_RATE_WAIT = float(os.getenv("MAX_RATE_WAIT", 10))
+RATE_RETRIES = int(os.getenv("RATE_RETRIES", 2))
+
+# JSON log lines, written to stdout by a background thread
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# === Structured logging (formatted and written off the request thread) ===
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {"ts": round(record.created, 3), "level": record.levelname, "msg": record.getMessage()}
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+def setup_logging():
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter())
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    atexit.register(listener.stop)
+
+    logger = logging.getLogger("binance_webhook_bot")
+    logger.setLevel(LOG_LEVEL)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.propagate = False
+    return logger
+
+log = setup_logging()
+
+def log_event(level, msg, **fields):
+    logger_level = logging.getLevelName(level.upper())
+    if log.isEnabledFor(logger_level):
+        log.log(logger_level, msg, extra={"fields": fields})
+
+log_event("info", "✅ Flask app loaded successfully")
+
+# === Metrics (Prometheus text format at /metrics, per process) ===
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+METRICS_HELP = {
+    "webhook_latency_seconds": ("histogram", "Total /webhook handling time"),
+    "binance_request_seconds": ("histogram", "Binance REST call time by call"),
+    "signing_seconds": ("histogram", "HMAC-SHA256 request signing time"),
+    "rate_limit_wait_seconds": ("histogram", "Time a call waited for rate-limit budget"),
+    "job_queue_wait_seconds": ("histogram", "Time a job waited in the queue before running"),
+    "rejects_total": ("counter", "Alerts and orders rejected, by reason"),
+    "binance_responses_total": ("counter", "Binance responses by call and HTTP status")
+}
+
+histograms = {}
+counters = {}
+metrics_lock = threading.Lock()
+
+def observe(name, seconds, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with metrics_lock:
+        h = histograms.get(key)
+        if h is None:
+            h = histograms[key] = {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                h["buckets"][i] += 1
+                break
+        h["sum"] += seconds
+        h["count"] += 1
+
+def inc(name, amount=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with metrics_lock:
+        counters[key] = counters.get(key, 0) + amount
+
+@contextmanager
+def timed(name, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+def label_str(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+# gauges: name -> (type, help, value) for values read from other state at scrape time
+def render_metrics(gauges):
+    lines = []
+    with metrics_lock:
+        hist_items = sorted((k, dict(v, buckets=list(v["buckets"]))) for k, v in histograms.items())
+        counter_items = sorted(counters.items())
+    seen = set()
+    for (name, labels), h in hist_items:
+        if name not in seen:
+            seen.add(name)
+            kind, help_text = METRICS_HELP.get(name, ("histogram", name))
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        cumulative = 0
+        for bound, n in zip(LATENCY_BUCKETS, h["buckets"]):
+            cumulative += n
+            lines.append(f"{name}_bucket{label_str(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{name}_bucket{label_str(labels, [('le', '+Inf')])} {h['count']}")
+        lines.append(f"{name}_sum{label_str(labels)} {h['sum']}")
+        lines.append(f"{name}_count{label_str(labels)} {h['count']}")
+    for (name, labels), value in counter_items:
+        if name not in seen:
+            seen.add(name)
+            kind, help_text = METRICS_HELP.get(name, ("counter", name))
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        lines.append(f"{name}{label_str(labels)} {value}")
+    for name, (kind, help_text, value) in gauges.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {value}"]
+    return "\n".join(lines) + "\n"
 
 app = Flask(__name__)
 
+# === Shared keep-alive session (one connection pool for all calls) ===
+def create_session(pool_size=POOL_SIZE):
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    s = requests.Session()
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    return s
+
+session = create_session()
+
+# === Rate-limit aware scheduler in front of every Binance request ===
+ENDPOINT_WEIGHTS = {
+    "/api/v3/account": 20,
+    "/api/v3/order": 1,
+    "/api/v3/exchangeInfo": 20,
+    "/api/v3/openOrders": 6,
+    "/api/v3/userDataStream": 2
+}
+
+class RateLimitError(Exception):
+    pass
+
+# Binance counts weight per clock minute and orders per 10-second window, so the
+# budget is a bucket that refills at each window boundary.
+rate_state = {
+    "weight_window": 0,
+    "used_weight_1m": 0,
+    "order_window": 0,
+    "order_count_10s": 0,
+    "blocked_until": 0.0,
+    "weight_waiting": 0,
+    "waits": 0,
+    "wait_seconds": 0.0,
+    "rejected": 0,
+    "responses_429": 0,
+    "responses_418": 0
+}
+rate_cond = threading.Condition()
+
+def request_weight(path, params=None):
+    if path == "/api/v3/openOrders" and not (params or {}).get("symbol"):
+        return 80
+    return ENDPOINT_WEIGHTS.get(path, 1)
+
+def roll_windows(now):
+    if int(now // 60) != rate_state["weight_window"]:
+        rate_state["weight_window"] = int(now // 60)
+        rate_state["used_weight_1m"] = 0
+    if int(now // 10) != rate_state["order_window"]:
+        rate_state["order_window"] = int(now // 10)
+        rate_state["order_count_10s"] = 0
+
+# Blocks until the budgets allow the call. Orders are high priority: low-priority
+# calls keep a weight reserve free for them and yield while an order is waiting
+# for weight (an order only short on the 10s order count doesn't hold them up).
+def acquire_budget(weight, is_order, high):
+    limit = WEIGHT_LIMIT if high else WEIGHT_LIMIT * LOW_PRIORITY_SHARE
+    deadline = time.time() + MAX_RATE_WAIT
+    short_on_weight = False
+    with rate_cond:
+        try:
+            while True:
+                now = time.time()
+                roll_windows(now)
+                delay = rate_state["blocked_until"] - now
+                needs_weight = rate_state["used_weight_1m"] + weight > limit
+                if needs_weight:
+                    delay = max(delay, 60 - now % 60)
+                if is_order and rate_state["order_count_10s"] + 1 > ORDER_LIMIT:
+                    delay = max(delay, 10 - now % 10)
+                if high and needs_weight != short_on_weight:
+                    short_on_weight = needs_weight
+                    rate_state["weight_waiting"] += 1 if needs_weight else -1
+                if not high and rate_state["weight_waiting"] > 0:
+                    delay = max(delay, 0.05)
+
+                if delay <= 0:
+                    rate_state["used_weight_1m"] += weight
+                    if is_order:
+                        rate_state["order_count_10s"] += 1
+                    return
+
+                if now + delay > deadline:
+                    rate_state["rejected"] += 1
+                    raise RateLimitError(f"Binance rate limit: would wait {delay:.1f}s (max {MAX_RATE_WAIT:.0f}s)")
+                rate_state["waits"] += 1
+                rate_state["wait_seconds"] += delay
+                rate_cond.wait(delay)
+        finally:
+            if short_on_weight:
+                rate_state["weight_waiting"] -= 1
+                rate_cond.notify_all()
+
+# Syncs the budgets with what Binance says this IP/account has used (other
+# gunicorn workers included), and backs off on 429/418
+def record_rate_headers(response):
+    used = response.headers.get("X-MBX-USED-WEIGHT-1M")
+    orders = response.headers.get("X-MBX-ORDER-COUNT-10S")
+    with rate_cond:
+        roll_windows(time.time())
+        if used is not None:
+            rate_state["used_weight_1m"] = max(rate_state["used_weight_1m"], int(used))
+        if orders is not None:
+            rate_state["order_count_10s"] = max(rate_state["order_count_10s"], int(orders))
+        if response.status_code in (429, 418):
+            rate_state[f"responses_{response.status_code}"] += 1
+            retry_after = float(response.headers.get("Retry-After") or (60 if response.status_code == 429 else 120))
+            rate_state["blocked_until"] = max(rate_state["blocked_until"], time.time() + retry_after)
+            log_event("warning", f"⛔ Binance {response.status_code}: backing off {retry_after:.0f}s",
+                      status=response.status_code, retry_after=retry_after)
+        rate_cond.notify_all()
+
+def call_name(path, params):
+    if path == "/api/v3/order":
+        return f"{(params or {}).get('type', '').lower()}_order"
+    return path.rsplit("/", 1)[-1]
+
+def scheduled_request(method, path, make_request, params=None):
+    is_order = method == "POST" and path == "/api/v3/order"
+    weight = request_weight(path, params)
+    call = call_name(path, params)
+    for attempt in range(RATE_RETRIES + 1):
+        with timed("rate_limit_wait_seconds", priority="high" if is_order else "low"):
+            acquire_budget(weight, is_order, high=is_order)
+        with timed("binance_request_seconds", call=call):
+            response = make_request()
+        inc("binance_responses_total", call=call, status=response.status_code)
+        record_rate_headers(response)
+        # A 429 was not executed, so it is safe to retry once the backoff allows it
+        if response.status_code != 429 or attempt == RATE_RETRIES:
+            return response
+    return response
+
+def rate_limit_snapshot():
+    with rate_cond:
+        roll_windows(time.time())
+        snapshot = dict(rate_state)
+    snapshot["blocked_for"] = max(snapshot.pop("blocked_until") - time.time(), 0.0)
+    snapshot["weight_limit"] = WEIGHT_LIMIT
+    snapshot["order_limit"] = ORDER_LIMIT
+    del snapshot["weight_window"], snapshot["order_window"]
+    return snapshot
+
+# === Signed request helper ===
+def sign(query_string):
+    with timed("signing_seconds"):
+        return hmac.new(
+            BINANCE_SECRET_KEY.encode(),
+            query_string.encode(),
+            hashlib.sha256
+        ).hexdigest()
+
+def signed_request(method, path, params=None):
+    headers = {"X-MBX-APIKEY": BINANCE_API_KEY}
+
+    def send():
+        signed = dict(params or {})
+        signed["timestamp"] = int(time.time() * 1000)
+        query_string = urlencode(signed)
+        url = f"{BASE_URL}{path}?{query_string}&signature={sign(query_string)}"
+        return session.request(method, url, headers=headers, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+
+    return scheduled_request(method, path, send, params)
+
+def api_key_request(method, path, params=None):
+    headers = {"X-MBX-APIKEY": BINANCE_API_KEY}
+    return scheduled_request(method, path, lambda: session.request(
+        method, f"{BASE_URL}{path}", headers=headers, params=params,
+        timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)), params)
+
+def public_request(method, path, params=None):
+    return scheduled_request(method, path, lambda: session.request(
+        method, f"{BASE_URL}{path}", params=params,
+        timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)), params)
+
 @app.route("/")
 def index():
     return "✅ Binance webhook bot is live."
 
+# === Balance cache (asset -> free) ===
+balances = {}
+balances_updated = 0.0
+stream_live = False
+balance_lock = threading.Lock()
+# asset -> account update time (ms) of the last balance the user-data stream sent
+stream_updates = {}
+
+def refresh_balances():
+    global balances_updated
+    response = signed_request("GET", "/api/v3/account")
+    data = response.json()
+    # An error body (418, 5xx, bad key) must not be cached as an empty account
+    if "balances" not in data:
+        raise ValueError(f"account fetch failed ({response.status_code}): {data}")
+    snapshot = {b["asset"]: float(b["free"]) for b in data["balances"]}
+    with balance_lock:
+        balances.clear()
+        balances.update(snapshot)
+        balances_updated = time.time()
+
+def invalidate_balances():
+    global balances_updated
+    balances_updated = 0.0
+
+# Apply our own order response so the cache stays current without a refetch.
+# A resting LIMIT SELL takes its full quantity out of free (it is locked).
+# The user-data stream sends absolute balances for the same fill, sometimes before
+# the REST response; an asset it has already updated since the order is left alone.
+def apply_order_result(base_asset, quote_asset, side, result):
+    done = result.get("transactTime", float("inf"))
+    deltas = {}
+
+    def add(asset, delta):
+        deltas[asset] = deltas.get(asset, 0.0) + delta
+
+    fills = result.get("fills", [])
+    if "executedQty" in result:
+        filled = float(result["executedQty"])
+        quote_amt = float(result.get("cummulativeQuoteQty", 0))
+    else:
+        filled = sum(float(f["qty"]) for f in fills)
+        quote_amt = sum(float(f["qty"]) * float(f["price"]) for f in fills)
+
+    if side == "BUY":
+        add(base_asset, filled)
+        add(quote_asset, -quote_amt)
+    else:
+        add(base_asset, -float(result.get("origQty", filled)))
+        add(quote_asset, quote_amt)
+
+    for f in fills:
+        add(f["commissionAsset"], -float(f["commission"]))
+
+    with balance_lock:
+        for asset, delta in deltas.items():
+            if stream_updates.get(asset, -1) < done:
+                balances[asset] = max(balances.get(asset, 0.0) + delta, 0.0)
+
 # === Get balance for given asset ===
 def get_spot_balance(asset):
     try:
-        headers = {"X-MBX-APIKEY": BINANCE_API_KEY}
-        timestamp = int(time.time() * 1000)
-        params = {"timestamp": timestamp}
-        query_string = '&'.join([f"{k}={params[k]}" for k in params])
-        signature = hmac.new(
-            BINANCE_SECRET_KEY.encode(),
-            query_string.encode(),
-            hashlib.sha256
-        ).hexdigest()
-        params["signature"] = signature
-
-        response = requests.get(f"{BASE_URL}/api/v3/account", headers=headers, params=params)
-        balances = response.json().get("balances", [])
-        for b in balances:
-            if b["asset"] == asset:
-                return float(b["free"])
-        return 0.0
+        if not stream_live and time.time() - balances_updated > BALANCE_TTL:
+            refresh_balances()
+        return balances.get(asset, 0.0)
     except Exception as e:
-        print(f"❌ Balance check failed: {e}")
+        log_event("error", f"❌ Balance check failed: {e}", asset=asset)
         return 0.0
 
+# === User-data stream: pushes balance updates into the cache ===
+def on_stream_message(ws, message):
+    event = json.loads(message)
+    if event.get("e") == "outboundAccountPosition":
+        with balance_lock:
+            for b in event["B"]:
+                balances[b["a"]] = float(b["f"])
+                stream_updates[b["a"]] = event.get("u", event.get("E", 0))
+
+def keep_listen_key_alive(listen_key, stop):
+    while not stop.wait(30 * 60):
+        try:
+            api_key_request("PUT", "/api/v3/userDataStream", {"listenKey": listen_key})
+        except Exception as e:
+            log_event("error", f"❌ listenKey keepalive failed: {e}")
+
+def run_user_stream():
+    global stream_live
+    while True:
+        stop = threading.Event()
+        try:
+            listen_key = api_key_request("POST", "/api/v3/userDataStream").json()["listenKey"]
+            threading.Thread(target=keep_listen_key_alive, args=(listen_key, stop), daemon=True).start()
+
+            def on_open(ws):
+                global stream_live
+                refresh_balances()
+                stream_live = True
+                log_event("info", "📡 User-data stream connected")
+
+            ws = websocket.WebSocketApp(f"{STREAM_URL}/{listen_key}",
+                                        on_open=on_open, on_message=on_stream_message)
+            ws.run_forever(ping_interval=60)
+        except Exception as e:
+            log_event("error", f"❌ User-data stream error: {e}")
+        stream_live = False
+        stop.set()
+        time.sleep(5)
+
+def start_user_stream():
+    if websocket is None:
+        log_event("warning", "⚠️ websocket-client not installed — balances refresh every BALANCE_TTL seconds")
+        return
+    threading.Thread(target=run_user_stream, daemon=True).start()
+
+if USER_STREAM:
+    start_user_stream()
+
+# === Exchange metadata cache (symbol -> base/quote assets and filters) ===
+symbol_info = {}
+symbol_info_lock = threading.Lock()
+
+def parse_symbol(s):
+    filters = {f["filterType"]: f for f in s.get("filters", [])}
+    lot = filters.get("LOT_SIZE", {})
+    market_lot = filters.get("MARKET_LOT_SIZE", {})
+    price = filters.get("PRICE_FILTER", {})
+    notional = filters.get("NOTIONAL") or filters.get("MIN_NOTIONAL") or {}
+    step = Decimal(lot.get("stepSize", "0"))
+    market_step = Decimal(market_lot.get("stepSize", "0"))
+    return {
+        "symbol": s["symbol"],
+        "status": s.get("status", "TRADING"),
+        "base": s["baseAsset"],
+        "quote": s["quoteAsset"],
+        "quote_precision": int(s.get("quoteAssetPrecision", s.get("quotePrecision", 8))),
+        "step": step,
+        "min_qty": Decimal(lot.get("minQty", "0")),
+        "market_step": market_step if market_step > 0 else step,
+        "market_min_qty": Decimal(market_lot.get("minQty", lot.get("minQty", "0"))),
+        "tick": Decimal(price.get("tickSize", "0")),
+        "min_notional": Decimal(notional.get("minNotional", "0")),
+        "min_notional_market": notional.get("applyMinToMarket", notional.get("applyToMarket", True))
+    }
+
+def load_exchange_info(symbol=None):
+    params = {"symbol": symbol} if symbol else None
+    response = public_request("GET", "/api/v3/exchangeInfo", params)
+    data = response.json()
+    if "symbols" not in data:
+        raise ValueError(f"exchangeInfo failed: {data}")
+    parsed = {s["symbol"]: parse_symbol(s) for s in data["symbols"]}
+    # Readers never lock, so a complete new dict is swapped in with one assignment
+    global symbol_info
+    with symbol_info_lock:
+        symbol_info = parsed if symbol is None else {**symbol_info, **parsed}
+    return parsed
+
+def get_symbol_info(symbol):
+    info = symbol_info.get(symbol)
+    if info is None:
+        try:
+            info = load_exchange_info(symbol).get(symbol)
+        except Exception as e:
+            log_event("error", f"❌ exchangeInfo lookup for {symbol} failed: {e}", symbol=symbol)
+    return info
+
+def run_exchange_info_refresh():
+    while True:
+        try:
+            load_exchange_info()
+            log_event("info", f"📘 Loaded exchange info for {len(symbol_info)} symbols")
+        except Exception as e:
+            log_event("error", f"❌ exchangeInfo refresh failed: {e}")
+        time.sleep(EXCHANGE_INFO_TTL)
+
+threading.Thread(target=run_exchange_info_refresh, daemon=True).start()
+
+# === Local rounding against symbol filters ===
+def floor_to(value, step):
+    value = Decimal(str(value))
+    if step <= 0:
+        return value
+    return (value / step).to_integral_value(ROUND_DOWN) * step
+
+def round_to(value, tick):
+    value = Decimal(str(value))
+    if tick <= 0:
+        return value
+    return (value / tick).to_integral_value(ROUND_HALF_UP) * tick
+
+def fmt(value):
+    return format(value.normalize(), "f")
+
+# === Order journal: append-only event log plus order/position tables ===
+JOURNAL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    kind TEXT NOT NULL,
+    symbol TEXT,
+    order_id INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_symbol ON events (symbol, id);
+CREATE INDEX IF NOT EXISTS events_order ON events (order_id);
+CREATE TABLE IF NOT EXISTS orders (
+    order_id INTEGER PRIMARY KEY,
+    symbol TEXT NOT NULL,
+    side TEXT,
+    type TEXT,
+    price TEXT,
+    quantity TEXT,
+    status TEXT,
+    buy_order_id INTEGER,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS orders_symbol_status ON orders (symbol, status);
+CREATE TABLE IF NOT EXISTS positions (
+    buy_order_id INTEGER PRIMARY KEY,
+    symbol TEXT NOT NULL,
+    quantity TEXT,
+    target TEXT,
+    take_profit_id INTEGER,
+    status TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS positions_status ON positions (status, symbol);
+"""
+
+OPEN_STATUSES = ("NEW", "PARTIALLY_FILLED")
+
+journal_queue = queue.SimpleQueue()
+
+def open_journal():
+    conn = sqlite3.connect(JOURNAL_PATH, timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(JOURNAL_SCHEMA)
+    return conn
+
+# Queues a journal event; the webhook path never waits on disk.
+def journal(kind, symbol=None, order_id=None, **data):
+    if JOURNAL_PATH:
+        journal_queue.put((time.time(), kind, symbol, order_id, data))
+
+def apply_journal_event(conn, ts, kind, symbol, order_id, data):
+    conn.execute("INSERT INTO events (ts, kind, symbol, order_id, data) VALUES (?, ?, ?, ?, ?)",
+                 (ts, kind, symbol, order_id, json.dumps(data, default=str)))
+    if kind == "order":
+        order = data["order"]
+        conn.execute("INSERT OR REPLACE INTO orders VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                     (order_id, symbol, order.get("side"), order.get("type"), order.get("price"),
+                      order.get("origQty"), order.get("status"), data.get("buy_order_id"), ts))
+    elif kind == "order_closed":
+        conn.execute("UPDATE orders SET status = 'CLOSED', updated = ? WHERE order_id = ?", (ts, order_id))
+    elif kind == "position":
+        conn.execute("""INSERT INTO positions VALUES (?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (buy_order_id) DO UPDATE SET
+                        take_profit_id = COALESCE(excluded.take_profit_id, take_profit_id),
+                        status = excluded.status, updated = excluded.updated""",
+                     (order_id, symbol, data.get("quantity"), data.get("target"),
+                      data.get("take_profit_id"), data["status"], ts))
+
+def run_journal_writer():
+    conn = open_journal()
+    while True:
+        events = [journal_queue.get()]
+        while True:
+            try:
+                events.append(journal_queue.get_nowait())
+            except queue.Empty:
+                break
+        stop = None in events
+        try:
+            with conn:
+                for event in events:
+                    if isinstance(event, tuple):
+                        apply_journal_event(conn, *event)
+        except Exception as e:
+            log_event("error", f"❌ Journal write failed: {e}", events=len(events))
+        for event in events:
+            if isinstance(event, threading.Event):
+                event.set()
+        if stop:
+            conn.close()
+            return
+
+# Blocks until everything queued so far is committed.
+def flush_journal(timeout=10):
+    if JOURNAL_PATH:
+        done = threading.Event()
+        journal_queue.put(done)
+        done.wait(timeout)
+
+def stop_journal_writer(writer):
+    journal_queue.put(None)
+    writer.join(timeout=5)
+
+# SIGTERM (how Heroku stops a dyno) kills `python main.py` without running atexit,
+# so exit through it instead. Gunicorn workers already leave through sys.exit on
+# SIGTERM; a handler that is already installed is left alone.
+def exit_on_sigterm(signum, frame):
+    sys.exit(0)
+
+if JOURNAL_PATH:
+    journal_writer = threading.Thread(target=run_journal_writer, daemon=True)
+    journal_writer.start()
+    atexit.register(stop_journal_writer, journal_writer)
+    if threading.current_thread() is threading.main_thread() and \
+            signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+        signal.signal(signal.SIGTERM, exit_on_sigterm)
+
+# === Per-symbol lock, shared across gunicorn workers through a lock file ===
+symbol_locks = {}
+symbol_locks_guard = threading.Lock()
+
+@contextmanager
+def symbol_lock(symbol):
+    with symbol_locks_guard:
+        lock = symbol_locks.setdefault(symbol, threading.Lock())
+    with lock:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(LOCK_DIR, exist_ok=True)
+        with open(os.path.join(LOCK_DIR, f"{symbol}.lock"), "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                # The file holds "<pid> <time>" of the last process that traded this symbol.
+                # If another worker traded since our balance snapshot, it is stale.
+                f.seek(0)
+                last = f.read().split()
+                if len(last) == 2 and int(last[0]) != os.getpid() and float(last[1]) > balances_updated:
+                    invalidate_balances()
+                yield
+            finally:
+                f.seek(0)
+                f.truncate()
+                f.write(f"{os.getpid()} {time.time()}")
+                f.flush()
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+# Any exception around an order POST (timeout, reset, bad body) leaves the fill
+# state unknown: the order may have executed, so the balance cache is dropped.
+def post_order(params):
+    try:
+        return signed_request("POST", "/api/v3/order", params).json()
+    except Exception:
+        invalidate_balances()
+        raise
+
+# === Rejections are returned as {"error": ...} and counted by reason ===
+def reject(reason, message, **details):
+    inc("rejects_total", reason=reason)
+    return {"error": message, **details}
+
 # === Send market order ===
-def send_order(symbol, action, size):
+# quote_balance: size BUYs from this amount instead of the live quote balance
+def send_order(symbol, action, size, quote_balance=None):
+    symbol = symbol.upper()
+    # Resolved before locking so only listed symbols get a lock and a lock file
+    if get_symbol_info(symbol) is None:
+        return reject("unknown_symbol", f"Unknown symbol: {symbol}")
+    with symbol_lock(symbol):
+        return execute_order(symbol, action, size, quote_balance)
+
+def execute_order(symbol, action, size, quote_balance=None):
     try:
-        timestamp = int(time.time() * 1000)
+        symbol = symbol.upper()
+        info = get_symbol_info(symbol)
+        if info is None:
+            return reject("unknown_symbol", f"Unknown symbol: {symbol}")
+        if info["status"] != "TRADING":
+            return reject("symbol_not_trading", f"{symbol} is not trading (status {info['status']})")
+
         params = {
-            "symbol": symbol.upper(),
+            "symbol": symbol,
             "side": action.upper(),
-            "type": "MARKET",
-            "timestamp": timestamp
+            "type": "MARKET"
         }
 
-        quote_asset = "USDC"
-        current_balance = get_spot_balance(quote_asset)
+        base_asset = info["base"]
+        quote_asset = info["quote"]
+        current_balance = get_spot_balance(quote_asset) if quote_balance is None else quote_balance
 
         if action.upper() == "BUY":
-            base_asset = symbol.upper().replace("USDC", "")
             asset_balance = get_spot_balance(base_asset)
             if asset_balance > 0.2:
-                return {"error": f"📦 Already holding {base_asset} — skipping BUY"}
+                return reject("already_holding", f"📦 Already holding {base_asset} — skipping BUY")
 
-            trade_usdc = round((current_balance * size) / 100, 2)
-            if trade_usdc < 5:
-                return {"error": f"Trade amount too small (${trade_usdc}). Minimum is $5."}
-            params["quoteOrderQty"] = trade_usdc
+            quote_step = Decimal(1).scaleb(-info["quote_precision"])
+            trade_quote = floor_to(current_balance * size / 100, quote_step)
+            if info["min_notional_market"] and trade_quote < info["min_notional"]:
+                return reject("min_notional", f"Trade amount too small ({fmt(trade_quote)} {quote_asset}). "
+                                              f"Minimum is {fmt(info['min_notional'])}.")
+            params["quoteOrderQty"] = fmt(trade_quote)
 
             # Place market BUY
-            query_string = '&'.join([f"{k}={params[k]}" for k in params])
-            signature = hmac.new(
-                BINANCE_SECRET_KEY.encode(),
-                query_string.encode(),
-                hashlib.sha256
-            ).hexdigest()
-            params["signature"] = signature
-            headers = {"X-MBX-APIKEY": BINANCE_API_KEY}
-            response = requests.post(f"{BASE_URL}/api/v3/order", headers=headers, params=params)
-            buy_result = response.json()
+            buy_result = post_order(params)
 
             if "fills" not in buy_result:
-                return {"error": "BUY order did not return fills", "details": buy_result}
+                invalidate_balances()
+                return reject("exchange_error", "BUY order did not return fills", details=buy_result)
+            apply_order_result(base_asset, quote_asset, "BUY", buy_result)
+            journal("order", symbol, buy_result.get("orderId"), order=buy_result)
 
             fills = buy_result.get("fills", [])
             total_qty = sum(float(f["qty"]) for f in fills)
             total_cost = sum(float(f["qty"]) * float(f["price"]) for f in fills)
             avg_price = total_cost / total_qty if total_qty else 0
-            target_price = round(avg_price * 1.015, 2)
-
-            print(f"🎯 Target price set at {target_price} for {total_qty} {base_asset}")
-
-            sell_params = {
-                "symbol": symbol.upper(),
-                "side": "SELL",
-                "type": "LIMIT",
-                "quantity": round(total_qty, 6),
-                "price": target_price,
-                "timeInForce": "GTC",
-                "timestamp": int(time.time() * 1000)
-            }
-            sell_qs = '&'.join([f"{k}={sell_params[k]}" for k in sell_params])
-            sell_sig = hmac.new(BINANCE_SECRET_KEY.encode(), sell_qs.encode(), hashlib.sha256).hexdigest()
-            sell_params["signature"] = sell_sig
-            sell_resp = requests.post(f"{BASE_URL}/api/v3/order", headers=headers, params=sell_params)
-            sell_result = sell_resp.json()
+            target_price = round_to(Decimal(str(avg_price)) * TAKE_PROFIT, info["tick"])
+
+            # Commission may have been taken in the base asset, so never ask for more than we hold
+            sell_qty = floor_to(min(total_qty, get_spot_balance(base_asset)), info["step"])
 
+            log_event("info", f"🎯 Target price set at {fmt(target_price)} for {fmt(sell_qty)} {base_asset}",
+                      symbol=symbol, price=fmt(target_price), quantity=fmt(sell_qty))
+            journal("position", symbol, buy_result.get("orderId"), quantity=fmt(sell_qty),
+                    target=fmt(target_price), status="pending")
+
+            sell_result = place_take_profit(info, buy_result.get("orderId"), sell_qty, target_price)
             return {"buy": buy_result, "limit_sell": sell_result}
 
         elif action.upper() == "SELL":
-            base_asset = symbol.upper().replace("USDC", "")
             balance = get_spot_balance(base_asset)
-            if balance <= 0:
-                return {"error": f"No {base_asset} balance available to sell."}
-            params["quantity"] = round(balance, 6)
-
-            query_string = '&'.join([f"{k}={params[k]}" for k in params])
-            signature = hmac.new(
-                BINANCE_SECRET_KEY.encode(),
-                query_string.encode(),
-                hashlib.sha256
-            ).hexdigest()
-            params["signature"] = signature
-            headers = {"X-MBX-APIKEY": BINANCE_API_KEY}
-            response = requests.post(f"{BASE_URL}/api/v3/order", headers=headers, params=params)
-            return response.json()
+            quantity = floor_to(balance, info["market_step"])
+            if quantity <= 0:
+                return reject("no_balance", f"No {base_asset} balance available to sell.")
+            if quantity < info["market_min_qty"]:
+                return reject("min_quantity", f"{base_asset} balance {fmt(quantity)} is below the minimum "
+                                               f"order size {fmt(info['market_min_qty'])}.")
+            params["quantity"] = fmt(quantity)
+
+            result = post_order(params)
+            if "orderId" in result:
+                apply_order_result(base_asset, quote_asset, "SELL", result)
+                journal("order", symbol, result["orderId"], order=result)
+            else:
+                inc("rejects_total", reason="exchange_error")
+                invalidate_balances()
+            return result
 
         else:
-            return {"error": f"Invalid action: {action}"}
+            return reject("invalid_action", f"Invalid action: {action}")
 
+    except RateLimitError as e:
+        return reject("rate_limited", str(e))
     except Exception as e:
-        return {"error": str(e)}
+        return reject("exception", str(e))
 
-@app.route("/webhook", methods=["POST"])
-def webhook():
-    data = request.get_json()
-    print("📦 Webhook received:", data)
+# Places the LIMIT SELL for a filled BUY. Errors are returned, not raised, so the
+# caller keeps the BUY result. An exchange reject marks the journal position failed;
+# after a timeout or other error it stays pending, as the SELL may have landed.
+def place_take_profit(info, buy_order_id, sell_qty, target_price):
+    symbol = info["symbol"]
+    if sell_qty < info["min_qty"] or sell_qty * target_price < info["min_notional"]:
+        journal("position", symbol, buy_order_id, status="skipped")
+        return reject("take_profit_filter", f"Take-profit order below {symbol} LOT_SIZE/NOTIONAL minimum",
+                      quantity=fmt(sell_qty), price=fmt(target_price))
+
+    sell_params = {
+        "symbol": symbol,
+        "side": "SELL",
+        "type": "LIMIT",
+        "quantity": fmt(sell_qty),
+        "price": fmt(target_price),
+        "timeInForce": "GTC"
+    }
+    try:
+        sell_result = post_order(sell_params)
+    except RateLimitError as e:
+        return reject("rate_limited", str(e))
+    except Exception as e:
+        return reject("exception", str(e))
+
+    if "orderId" in sell_result:
+        apply_order_result(info["base"], info["quote"], "SELL", sell_result)
+        journal("order", symbol, sell_result["orderId"], order=sell_result, buy_order_id=buy_order_id)
+        journal("position", symbol, buy_order_id, take_profit_id=sell_result["orderId"], status="protected")
+    else:
+        inc("rejects_total", reason="exchange_error")
+        invalidate_balances()
+        journal("position", symbol, buy_order_id, status="failed")
+    return sell_result
+
+# === Startup reconciliation of the journal against Binance openOrders ===
+# A take-profit that reached Binance but not the journal shows up as an open LIMIT SELL
+def find_take_profit(orders, symbol, target):
+    return next((o for o in orders if o["symbol"] == symbol and o["side"] == "SELL"
+                 and o["type"] == "LIMIT" and Decimal(o["price"]) == Decimal(target)), None)
+
+# Only symbols with journaled open orders or pending positions are checked, one
+# openOrders call each (or a single all-symbols call when that is cheaper).
+def reconcile_journal():
+    conn = open_journal()
+    try:
+        marks = ",".join("?" * len(OPEN_STATUSES))
+        open_rows = conn.execute(f"SELECT order_id, symbol FROM orders WHERE status IN ({marks})",
+                                 OPEN_STATUSES).fetchall()
+        pending = conn.execute("SELECT buy_order_id, symbol, quantity, target, updated FROM positions "
+                               "WHERE status = 'pending'").fetchall()
+    finally:
+        conn.close()
+
+    symbols = {symbol for _, symbol in open_rows} | {p[1] for p in pending}
+    if not symbols:
+        return {"checked": 0}
+
+    if len(symbols) * request_weight("/api/v3/openOrders", {"symbol": "X"}) > request_weight("/api/v3/openOrders"):
+        live = signed_request("GET", "/api/v3/openOrders").json()
+    else:
+        live = []
+        for symbol in symbols:
+            live += signed_request("GET", "/api/v3/openOrders", {"symbol": symbol}).json()
+    if not isinstance(live, list):
+        raise ValueError(f"openOrders failed: {live}")
+    live = {o["orderId"]: o for o in live if o["symbol"] in symbols}
+
+    journaled = {order_id for order_id, _ in open_rows}
+    closed = journaled - set(live)
+    for order_id, symbol in open_rows:
+        if order_id in closed:
+            journal("order_closed", symbol, order_id)
+    adopted = [o for order_id, o in live.items() if order_id not in journaled]
+    for o in adopted:
+        journal("order", o["symbol"], o["orderId"], order=o, adopted=True)
+
+    resumed = expired = unprotected = 0
+    for buy_order_id, symbol, quantity, target, updated in pending:
+        match = find_take_profit(live.values(), symbol, target)
+        if match:
+            journal("position", symbol, buy_order_id, take_profit_id=match["orderId"], status="protected")
+            continue
+        # The target is stale by now and the balance may have been traded since
+        if time.time() - updated > RESUME_MAX_AGE:
+            journal("position", symbol, buy_order_id, status="expired")
+            log_event("warning", f"⚠️ Take-profit for {symbol} never placed; too old to resume",
+                      buy_order_id=buy_order_id, quantity=quantity, target=target)
+            expired += 1
+            continue
+        info = get_symbol_info(symbol)
+        if not RESUME_TAKE_PROFIT or info is None:
+            log_event("warning", f"⚠️ Take-profit for {symbol} never placed; position is unprotected",
+                      buy_order_id=buy_order_id, quantity=quantity, target=target,
+                      resume=RESUME_TAKE_PROFIT)
+            unprotected += 1
+            continue
+        with symbol_lock(symbol):
+            # The BUY may have been in flight on another worker; its SELL may have landed since
+            live = signed_request("GET", "/api/v3/openOrders", {"symbol": symbol}).json()
+            if not isinstance(live, list):
+                raise ValueError(f"openOrders failed: {live}")
+            match = find_take_profit(live, symbol, target)
+            if match:
+                journal("position", symbol, buy_order_id, take_profit_id=match["orderId"], status="protected")
+                continue
+            sell_qty = floor_to(min(Decimal(quantity), Decimal(str(get_spot_balance(info["base"])))), info["step"])
+            result = place_take_profit(info, buy_order_id, sell_qty, Decimal(target))
+        resumed += "orderId" in result
+        log_event("info", f"🔁 Take-profit resumed for {symbol}", buy_order_id=buy_order_id,
+                  result=summarize(result))
+
+    summary = {"checked": len(symbols), "closed": len(closed), "adopted": len(adopted),
+               "pending": len(pending), "resumed": resumed, "expired": expired,
+               "unprotected": unprotected}
+    journal("reconcile", **summary)
+    return summary
+
+# Every process reconciles on startup, one at a time: its journal writes are
+# flushed before the lock is released, so the next gunicorn worker finds the
+# journal already matching Binance and has nothing left to do.
+def startup_reconcile():
+    if not JOURNAL_PATH:
+        return
+    try:
+        os.makedirs(LOCK_DIR, exist_ok=True)
+        with open(os.path.join(LOCK_DIR, "journal-reconcile.lock"), "a+") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                summary = reconcile_journal()
+            finally:
+                flush_journal()
+            log_event("info", "📒 Journal reconciled", **summary)
+    except Exception as e:
+        log_event("error", f"❌ Journal reconcile failed: {e}")
+
+threading.Thread(target=startup_reconcile, daemon=True).start()
+
+# === Job queue: one FIFO per symbol, symbols run in parallel on the pool ===
+executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="order")
+jobs = OrderedDict()
+symbol_queues = {}
+jobs_lock = threading.Lock()
+
+def submit_job(symbol, action, size):
+    job = {
+        "id": uuid.uuid4().hex,
+        "symbol": symbol.upper(),
+        "action": action.upper(),
+        "size": size,
+        "status": "queued",
+        "result": None,
+        "created": time.time(),
+        "started": None,
+        "finished": None
+    }
+    with jobs_lock:
+        jobs[job["id"]] = job
+        while len(jobs) > JOB_HISTORY:
+            oldest = next(iter(jobs.values()))
+            if oldest["status"] in ("queued", "running"):
+                break
+            jobs.popitem(last=False)
+
+        pending = symbol_queues.setdefault(job["symbol"], deque())
+        pending.append(job)
+        if len(pending) == 1:
+            executor.submit(run_symbol_queue, job["symbol"])
+    return job
+
+def run_job(job):
+    job["status"] = "running"
+    job["started"] = time.time()
+    observe("job_queue_wait_seconds", job["started"] - job["created"])
+    result = send_order(job["symbol"], job["action"], job["size"])
+    log_event("info", f"✅ Job {job['id']} finished", job_id=job["id"], symbol=job["symbol"],
+              action=job["action"], result=summarize(result))
+    log_event("debug", "Binance response", job_id=job["id"], result=result)
+    job["result"] = result
+    job["status"] = "failed" if "error" in result else "done"
+    job["finished"] = time.time()
+
+def run_symbol_queue(symbol):
+    while True:
+        with jobs_lock:
+            job = symbol_queues[symbol][0]
+        try:
+            run_job(job)
+        except Exception as e:
+            job["result"] = {"error": str(e)}
+            job["status"] = "failed"
+            job["finished"] = time.time()
+        with jobs_lock:
+            pending = symbol_queues[symbol]
+            pending.popleft()
+            if not pending:
+                del symbol_queues[symbol]
+                return
+
+# === Duplicate alert cache ===
+# Shared by all workers through marker files in LOCK_DIR/alerts (one per key,
+# mtime = first seen), claimed under a lock file so only one worker wins a key.
+# A bounded in-process LRU answers repeats seen by this worker without disk I/O.
+ALERT_DIR = os.path.join(LOCK_DIR, "alerts")
+seen_alerts = OrderedDict()
+seen_alerts_lock = threading.Lock()
+alert_claims = 0
+
+def alert_key(data):
+    alert_id = data.get("alert_id") or data.get("id")
+    if alert_id:
+        return f"id:{alert_id}"
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+def alert_marker(key):
+    return os.path.join(ALERT_DIR, hashlib.sha256(key.encode()).hexdigest())
 
+@contextmanager
+def alert_dir_lock():
+    os.makedirs(ALERT_DIR, exist_ok=True)
+    with seen_alerts_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(LOCK_DIR, "alerts.lock"), "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+def prune_alert_markers(now):
+    for name in os.listdir(ALERT_DIR):
+        path = os.path.join(ALERT_DIR, name)
+        try:
+            if now - os.stat(path).st_mtime >= DEDUP_WINDOW:
+                os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+# Returns (entry, duplicate): the earlier entry for a duplicate, else a freshly claimed one.
+def claim_alert(key):
+    global alert_claims
+    now = time.time()
+    with seen_alerts_lock:
+        entry = seen_alerts.get(key)
+        if entry and now - entry["seen"] < DEDUP_WINDOW:
+            seen_alerts.move_to_end(key)
+            return entry, True
+
+    path = alert_marker(key)
+    with alert_dir_lock():
+        try:
+            seen = os.stat(path).st_mtime
+            if now - seen < DEDUP_WINDOW:
+                # Claimed by another worker; its result is there once it has finished
+                with open(path) as f:
+                    stored = json.loads(f.read() or "{}")
+                return {"seen": seen, "job_id": stored.get("job_id"), "result": stored.get("result")}, True
+        except (FileNotFoundError, ValueError):
+            pass
+        with open(path, "w") as f:
+            f.write("{}")
+
+        entry = {"seen": now, "job_id": None, "result": None}
+        seen_alerts[key] = entry
+        while len(seen_alerts) > DEDUP_MAX:
+            seen_alerts.popitem(last=False)
+        alert_claims += 1
+        if alert_claims % 256 == 0:
+            prune_alert_markers(now)
+    return entry, False
+
+# Stores the outcome so duplicates on any worker can return it; keeps the first-seen mtime.
+def record_alert(key, entry):
+    path = alert_marker(key)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}"
+    try:
+        with open(tmp, "w") as f:
+            json.dump({"job_id": entry["job_id"], "result": entry["result"]}, f, default=str)
+        os.utime(tmp, (entry["seen"], entry["seen"]))
+        os.replace(tmp, path)
+    except OSError as e:
+        log_event("error", f"❌ Could not record alert result: {e}")
+
+# Drops a claim whose request failed before placing an order, so a retry runs again.
+def release_alert(key):
+    with alert_dir_lock():
+        seen_alerts.pop(key, None)
+        try:
+            os.unlink(alert_marker(key))
+        except FileNotFoundError:
+            pass
+
+# === Webhook payload validation ===
+SYMBOL_PATTERN = re.compile(r"^[A-Z0-9]{1,20}$")
+
+# Returns (alert, reason, error); alert is None when the payload is rejected.
+def parse_alert(data):
     symbol = data.get("symbol")
     action = data.get("action")
     size = data.get("size")
 
     if not all([symbol, action, size is not None]):
-        return jsonify({"error": "Missing one or more required fields"}), 400
+        return None, "missing_fields", "Missing one or more required fields"
+
+    # The symbol names a lock file, so only plain exchange-style names get through
+    if not isinstance(symbol, str) or not SYMBOL_PATTERN.match(symbol.strip().upper()):
+        return None, "invalid_symbol", f"Invalid symbol: {symbol!r}"
+    symbol = symbol.strip().upper()
+
+    if str(action).upper() not in ("BUY", "SELL"):
+        return None, "invalid_action", f"Invalid action: {action}"
 
     try:
         size = float(size)
-    except ValueError:
-        return jsonify({"error": "Invalid size format"}), 400
+    except (TypeError, ValueError):
+        return None, "invalid_size", "Invalid size format"
+
+    return (symbol, action, size), None, None
+
+# Short form of an order result for the INFO log; the full response is logged at DEBUG
+def summarize(result):
+    if "error" in result:
+        return {"error": result["error"]}
+    if "buy" in result:
+        sell = result["limit_sell"]
+        return {"buy": result["buy"].get("orderId"), "limit_sell": sell.get("orderId") or sell.get("error")}
+    return {"orderId": result.get("orderId"), "status": result.get("status"),
+            "code": result.get("code"), "msg": result.get("msg")}
+
+@app.before_request
+def start_timer():
+    g.started = time.perf_counter()
+
+@app.after_request
+def record_latency(response):
+    if request.endpoint and request.endpoint.startswith("webhook"):
+        observe("webhook_latency_seconds", time.perf_counter() - g.started,
+                endpoint=request.endpoint, status=response.status_code)
+    return response
+
+@app.route("/webhook", methods=["POST"])
+def webhook():
+    data = request.get_json()
+    log_event("info", "📦 Webhook received", symbol=data.get("symbol"), action=data.get("action"),
+              size=data.get("size"))
+    log_event("debug", "Webhook payload", payload=data)
+
+    alert, reason, error = parse_alert(data)
+    if error:
+        inc("rejects_total", reason=reason)
+        return jsonify({"error": error}), 400
+    symbol, action, size = alert
+
+    key = alert_key(data)
+    entry, duplicate = claim_alert(key)
+    if duplicate:
+        inc("rejects_total", reason="duplicate")
+        log_event("info", "♻️ Duplicate alert ignored", key=key)
+        if entry["job_id"]:
+            job = jobs.get(entry["job_id"], {})
+            return jsonify({"duplicate": True, "job_id": entry["job_id"], "status": job.get("status")})
+        return jsonify({"duplicate": True, "result": entry["result"]})
+
+    journal("alert", symbol.upper(), payload=data)
 
-    result = send_order(symbol, action, size)
-    print("✅ Binance response:", result)
+    if JOB_MODE:
+        job = submit_job(symbol, action, size)
+        entry["job_id"] = job["id"]
+        record_alert(key, entry)
+        return jsonify({"job_id": job["id"], "status": job["status"]}), 202
+
+    try:
+        result = send_order(symbol, action, size)
+    except Exception as e:
+        inc("rejects_total", reason="exception")
+        log_event("error", f"❌ Order failed: {e}", symbol=symbol)
+        release_alert(key)
+        return jsonify({"error": str(e)}), 502
+    # A reject means no order went out, so TradingView's retry gets to run it again
+    if "error" in result:
+        release_alert(key)
+    else:
+        entry["result"] = result
+        record_alert(key, entry)
+    log_event("info", "✅ Binance response", symbol=symbol, action=action.upper(), result=summarize(result))
+    log_event("debug", "Binance response", result=result)
     return jsonify(result)
 
+# === Batch execution: one balance snapshot, symbols in parallel ===
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="batch")
+
+def run_symbol_items(items, snapshot):
+    results = []
+    for index, (symbol, action, size), quote in items:
+        results.append((index, send_order(symbol, action, size, snapshot.get(quote))))
+    return results
+
+def execute_batch(alerts):
+    # One account fetch for the whole bundle; every BUY is sized from this snapshot
+    refresh_balances()
+    quotes = {}
+    for index, alert in alerts:
+        info = get_symbol_info(alert[0].upper())
+        quotes[index] = info["quote"] if info else None
+    snapshot = {q: get_spot_balance(q) for q in set(quotes.values()) if q}
+
+    # Items for the same symbol run in order on one worker; symbols run concurrently
+    by_symbol = OrderedDict()
+    for index, alert in alerts:
+        by_symbol.setdefault(alert[0].upper(), []).append((index, alert, quotes[index]))
+    futures = [batch_executor.submit(run_symbol_items, items, snapshot) for items in by_symbol.values()]
+
+    results = {}
+    for future in futures:
+        results.update(future.result())
+    return results, snapshot
+
+@app.route("/webhook/batch", methods=["POST"])
+def webhook_batch():
+    data = request.get_json()
+    items = data.get("alerts") if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        inc("rejects_total", reason="invalid_batch")
+        return jsonify({"error": "Expected a non-empty list of alerts"}), 400
+    if len(items) > BATCH_MAX:
+        inc("rejects_total", reason="invalid_batch")
+        return jsonify({"error": f"Batch has {len(items)} alerts; maximum is {BATCH_MAX}"}), 400
+    log_event("info", "📦 Batch webhook received", items=len(items))
+    log_event("debug", "Batch payload", payload=data)
+
+    entries = [None] * len(items)
+    alerts = []
+    buy_pct = 0.0
+    for i, item in enumerate(items):
+        alert, reason, error = parse_alert(item) if isinstance(item, dict) else \
+            (None, "invalid_item", "Alert must be an object")
+        if error:
+            inc("rejects_total", reason=reason)
+            entries[i] = {"alert": item, "result": {"error": error}}
+            continue
+        alerts.append((i, alert))
+        if alert[1].upper() == "BUY":
+            buy_pct += alert[2]
+
+    if buy_pct > 100:
+        inc("rejects_total", reason="invalid_batch")
+        return jsonify({"error": f"BUY sizes add up to {buy_pct}% of the quote balance"}), 400
+
+    key = alert_key({"batch": items})
+    entry, duplicate = claim_alert(key)
+    if duplicate:
+        inc("rejects_total", reason="duplicate")
+        log_event("info", "♻️ Duplicate batch ignored", key=key)
+        return jsonify({"duplicate": True, "result": entry["result"]})
+
+    for i, alert in alerts:
+        journal("alert", alert[0].upper(), payload=items[i], batch=True)
+
+    try:
+        results, snapshot = execute_batch(alerts) if alerts else ({}, {})
+    except Exception as e:
+        inc("rejects_total", reason="rate_limited" if isinstance(e, RateLimitError) else "exception")
+        log_event("error", f"❌ Batch failed: {e}")
+        release_alert(key)
+        return jsonify({"error": str(e)}), 502
+    for i, (symbol, action, size) in alerts:
+        entries[i] = {"alert": items[i], "result": results[i]}
+
+    response = {"quote_balances": snapshot, "results": entries}
+    entry["result"] = response
+    record_alert(key, entry)
+    log_event("info", "✅ Batch executed", items=len(items),
+              results=[summarize(e["result"]) for e in entries])
+    log_event("debug", "Batch responses", results=entries)
+    return jsonify(response)
+
+@app.route("/metrics")
+def metrics():
+    rate = rate_limit_snapshot()
+    with jobs_lock:
+        pending = sum(len(q) for q in symbol_queues.values())
+    gauges = {
+        "binance_used_weight_1m": ("gauge", "Request weight used in the current minute", rate["used_weight_1m"]),
+        "binance_weight_limit": ("gauge", "Request weight budget per minute", rate["weight_limit"]),
+        "binance_order_count_10s": ("gauge", "Orders placed in the current 10s window", rate["order_count_10s"]),
+        "binance_order_limit": ("gauge", "Order budget per 10s", rate["order_limit"]),
+        "binance_backoff_seconds": ("gauge", "Remaining Retry-After backoff", rate["blocked_for"]),
+        "binance_rate_limited_total": ("counter", "429 and 418 responses received",
+                                       rate["responses_429"] + rate["responses_418"]),
+        "binance_rate_rejected_total": ("counter", "Calls refused locally for exceeding MAX_RATE_WAIT", rate["rejected"]),
+        "jobs_pending": ("gauge", "Jobs queued or running", pending),
+        "balance_cache_age_seconds": ("gauge", "Age of the account balance snapshot",
+                                      time.time() - balances_updated if balances_updated else -1),
+        "user_stream_connected": ("gauge", "1 while the user-data stream is live", int(stream_live)),
+        "journal_queue_depth": ("gauge", "Journal events waiting to be written", journal_queue.qsize())
+    }
+    return Response(render_metrics(gauges), mimetype="text/plain; version=0.0.4")
+
+@app.route("/ratelimit")
+def rate_limit_status():
+    return jsonify(rate_limit_snapshot())
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job id"}), 404
+    return jsonify(job)
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port)